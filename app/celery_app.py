@@ -2,10 +2,14 @@
 Celery configuration for asynchronous task processing
 """
 from celery import Celery
-import os
+from celery.signals import worker_process_init
 
-# Get Redis URL for Celery broker
-redis_url = os.getenv("REDIS_PUBLIC_URL") or os.getenv("REDIS_URL", "redis://localhost:6379/0")
+# Reuse the Redis URL resolved for the cache client as the Celery broker
+from app.redis_client import redis_url
+
+TASK_TIME_LIMIT = 7200  # 2 hours max
+# Headroom for the time a delivered import waits before a worker starts it
+BROKER_QUEUE_WAIT = 3600
 
 # Create Celery app
 celery_app = Celery(
@@ -23,7 +27,33 @@ celery_app.conf.update(
     timezone="UTC",
     enable_utc=True,
     task_track_started=True,
-    task_time_limit=7200,  # 2 hours max
+    task_time_limit=TASK_TIME_LIMIT,
     worker_prefetch_multiplier=1,
+    task_acks_late=True,  # Redeliver imports if a worker dies mid-file
+    task_reject_on_worker_lost=True,
     worker_max_tasks_per_child=1000,
-)
\ No newline at end of file
+    worker_max_memory_per_child=500_000,  # KB, recycle workers that grow past ~500MB
+    # Unacked messages are redelivered once this expires, so it must outlast the
+    # longest run plus the time a message waits behind a busy worker; otherwise a
+    # healthy import is handed to a second worker and the file is imported twice
+    broker_transport_options={"visibility_timeout": TASK_TIME_LIMIT + BROKER_QUEUE_WAIT},
+    result_expires=3600,
+)
+
+
+@worker_process_init.connect
+def init_worker_process(**kwargs):
+    """
+    Prepare connections in each forked worker process
+    
+    Pooled DB connections inherited from the parent would share its
+    sockets, so they are dropped without being closed. The Redis pool is
+    opened up front, so the first task doesn't pay for the connect.
+    Registered here rather than in start_worker.py so it also applies when
+    the worker is started with the celery CLI.
+    """
+    from app.database import engine
+    from app.redis_client import RedisCache
+    
+    engine.dispose(close=False)
+    RedisCache.ping()
@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
@@ -11,26 +11,113 @@ if not DATABASE_URL:
 
 print(f"Using Database URL: {DATABASE_URL[:50]}..." if DATABASE_URL else "No Database URL found")
 
-engine = create_engine(DATABASE_URL)
+# Explicit pool sizing: pre-ping recycles connections the server dropped,
+# pool_recycle retires them before idle-timeouts on managed Postgres hit
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "20"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+engine = create_engine(
+    DATABASE_URL,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=30,
+    pool_pre_ping=True,
+    pool_recycle=1800,
+    connect_args={"options": f"-c statement_timeout={os.getenv('DB_STATEMENT_TIMEOUT_MS', '30000')}"}
+)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Session-level advisory lock key serializing schema setup across processes
+SCHEMA_LOCK_KEY = 0x41636D65  # "Acme"
+
 Base = declarative_base()
 
 # Track if tables have been initialized
 _tables_initialized = False
 
 def ensure_tables_exist():
-    """Ensure database tables exist, create if they don't"""
+    """
+    Ensure database tables and indexes exist, create them if they don't
+    
+    Setup runs on one dedicated connection, under a session advisory lock so
+    concurrent web workers take turns instead of racing on CREATE, and with
+    statement_timeout disabled so index builds on large tables can finish.
+    
+    Raises:
+        RuntimeError: If SKUs differ only by case (the lower(sku) unique
+            index can't be built until they are cleaned up) or any declared
+            index could not be created. The app relies on
+            uq_products_sku_lower for ON CONFLICT (lower(sku)), so it must
+            not start without it.
+    """
     global _tables_initialized
-    if not _tables_initialized:
+    if _tables_initialized:
+        return
+    
+    with engine.connect() as conn:
+        conn.execute(text("SET statement_timeout = 0"))
+        conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": SCHEMA_LOCK_KEY})
+        conn.commit()
         try:
-            Base.metadata.create_all(bind=engine)
-            _tables_initialized = True
-            print("Database tables initialized successfully")
-        except Exception as e:
-            print(f"Database table creation failed: {e}")
-            # Don't set _tables_initialized = True so it will retry later
-            pass
+            Base.metadata.create_all(bind=conn)
+            conn.commit()
+            _check_case_variant_skus(conn)
+            
+            # create_all only builds indexes for new tables; add any declared
+            # since. Every index is attempted so one failure doesn't hide the others.
+            failed = []
+            for table in Base.metadata.sorted_tables:
+                for index in table.indexes:
+                    try:
+                        index.create(bind=conn, checkfirst=True)
+                        conn.commit()
+                    except Exception as e:
+                        conn.rollback()
+                        print(f"Creating index {index.name} failed: {e}")
+                        failed.append(index.name)
+            if failed:
+                raise RuntimeError(f"Database indexes could not be created: {', '.join(failed)}")
+        finally:
+            conn.rollback()
+            conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": SCHEMA_LOCK_KEY})
+            conn.execute(text("RESET statement_timeout"))  # Back to the pool default
+            conn.commit()
+    
+    _tables_initialized = True
+    print("Database tables initialized successfully")
+
+
+def _check_case_variant_skus(conn):
+    """
+    Refuse to build the lower(sku) unique index over SKUs that differ only by case
+    
+    Databases created before uq_products_sku_lower can hold 'abc-1' from
+    the API next to 'ABC-1' from an import. Rows are never removed here;
+    the conflicting SKUs are reported so they can be merged by hand (see
+    "Upgrading an existing database" in the README). Does nothing once the
+    index exists.
+    
+    Raises:
+        RuntimeError: Listing the conflicting SKU groups
+    """
+    if conn.execute(text("SELECT to_regclass('uq_products_sku_lower')")).scalar():
+        return
+    conflicts = conn.execute(text("""
+        SELECT string_agg(sku, ', ' ORDER BY id)
+        FROM products
+        GROUP BY lower(sku)
+        HAVING count(*) > 1
+        ORDER BY lower(sku)
+        LIMIT 50
+    """)).scalars().all()
+    conn.commit()
+    if conflicts:
+        listed = "; ".join(conflicts)
+        raise RuntimeError(
+            "Products have SKUs that differ only by case, so uq_products_sku_lower "
+            f"can't be created. Merge or rename them first (first {len(conflicts)} "
+            f"groups shown): {listed}"
+        )
+
 
 def get_db():
     db = SessionLocal()
@@ -38,10 +125,3 @@ def get_db():
         yield db
     finally:
         db.close()
-
-def init_db_async():
-    """Initialize database tables asynchronously"""
-    import threading
-    thread = threading.Thread(target=ensure_tables_exist)
-    thread.daemon = True
-    thread.start()
\ No newline at end of file
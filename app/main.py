@@ -8,31 +8,39 @@ Author: Backend Engineer Assessment
 Date: 2024
 """
 
-from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Request, Form
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Request, Form, Response, Query
+from fastapi.responses import HTMLResponse, ORJSONResponse
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.concurrency import run_in_threadpool
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
+from anyio import to_thread
 from sqlalchemy.orm import Session
-from sqlalchemy import func, text
-from typing import List, Optional
+from sqlalchemy import func, text, select, lambda_stmt
+from sqlalchemy.exc import IntegrityError
+from pydantic import TypeAdapter
+from typing import BinaryIO, List, Optional
 import os
-import csv
-import io
 import uuid
+import hashlib
 import asyncio
-import threading
-from datetime import datetime, timezone, timedelta
+import orjson
 
-from app.database import get_db, engine
-from app.models import Product, Webhook, ImportJob, Base
+from app.database import get_db, SessionLocal, ensure_tables_exist, DB_POOL_SIZE, DB_MAX_OVERFLOW
+from app.models import Product, Webhook, ImportJob
 from app.schemas import ProductResponse, WebhookResponse
-from app.redis_client import RedisCache
-from app.utils import get_health_status, get_metrics
+from app.redis_client import RedisCache, redis_client
+from app.utils import (
+    get_health_status, get_metrics, clear_products_cache,
+    get_products_cache_key, PRODUCTS_CACHE_INDEX_KEY, METRICS_CACHE_KEY
+)
+from app.tasks import queue_csv_import, emit_webhook_event, IMPORT_PAYLOAD_KEY, PayloadTooLargeError
 
-# Database tables will be initialized on first request
+# Database tables are initialized in the startup event
 
 # FastAPI application instance
 app = FastAPI(
+    default_response_class=ORJSONResponse,
     title="Acme Product Importer",
     description="A scalable web application for importing products from CSV files",
     version="1.0.0",
@@ -40,6 +48,29 @@ app = FastAPI(
     redoc_url="/api/redoc"
 )
 
+# Compress JSON responses (product pages are mostly repeated keys)
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
+# Worker threads available to sync (def) endpoints. Nearly all of them hold
+# a DB connection, so by default match the pool: extra threads would only
+# queue on pool checkout while adding context switches and GIL contention.
+THREADPOOL_SIZE = int(os.getenv("THREADPOOL_SIZE", str(DB_POOL_SIZE + DB_MAX_OVERFLOW)))
+
+# Upper bound on one product listing page, so a request can't pull the table
+MAX_PAGE_SIZE = 500
+
+# Unfiltered product counts switch to the planner estimate above this size
+ESTIMATED_COUNT_THRESHOLD = 100_000
+
+# Validates and serializes product pages in one call instead of per row
+product_list_adapter = TypeAdapter(List[ProductResponse])
+
+# Columns selected for product listings, in ProductResponse field order
+PRODUCT_COLUMNS = (
+    Product.id, Product.name, Product.sku, Product.description,
+    Product.active, Product.created_at, Product.updated_at,
+)
+
 # Static files and templates
 app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
@@ -49,11 +80,16 @@ templates = Jinja2Templates(directory="templates")
 async def startup_event():
     """Application startup tasks"""
     print("Acme Product Importer starting up...")
-    print("Initializing database tables in background...")
+    print("Initializing database tables...")
+    
+    # Create tables and indexes before accepting traffic, without blocking
+    # the event loop; a failure here aborts startup
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, ensure_tables_exist)
     
-    # Initialize database tables in background thread
-    from app.database import init_db_async
-    init_db_async()
+    # Sync endpoints run on AnyIO's worker threads (40 by default); size the
+    # limit to the DB pool so requests wait for a thread, not a connection
+    to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
 
 
 # ============================================================================
@@ -86,14 +122,17 @@ async def webhooks_page(request: Request):
 # HEALTH & MONITORING ENDPOINTS
 # ============================================================================
 
+# Handlers without blocking I/O are async so they answer on the event loop
+# even when every worker thread is tied up in a slow query
+
 @app.get("/ping", tags=["Monitoring"])
-def ping():
+async def ping():
     """Simple ping endpoint for basic health check"""
     return {"status": "ok", "message": "Acme Product Importer is running"}
 
 
 @app.get("/status", tags=["Monitoring"])
-def status():
+async def status():
     """Quick status check without database dependencies"""
     return {
         "status": "running",
@@ -105,16 +144,20 @@ def status():
 @app.get("/api/recent-jobs", tags=["CSV Import"])
 def get_recent_jobs(db: Session = Depends(get_db)):
     """Get recent import jobs"""
-    jobs = db.query(ImportJob).order_by(ImportJob.created_at.desc()).limit(10).all()
-    return [{
-        "id": job.id,
-        "filename": job.filename,
-        "status": job.status,
-        "records_processed": job.records_processed,
-        "total_records": job.total_records,
-        "active": job.active,
-        "created_at": job.created_at.replace(tzinfo=timezone.utc).astimezone(timezone(timedelta(hours=5, minutes=30))).strftime("%Y-%m-%d %H:%M:%S IST") if job.created_at else None
-    } for job in jobs]
+    # PostgreSQL converts and formats the timestamp as part of the query
+    jobs = db.query(
+        ImportJob.id,
+        ImportJob.filename,
+        ImportJob.status,
+        ImportJob.records_processed,
+        ImportJob.total_records,
+        ImportJob.active,
+        func.to_char(
+            func.timezone("Asia/Kolkata", ImportJob.created_at),
+            'YYYY-MM-DD HH24:MI:SS "IST"'
+        ).label("created_at")
+    ).order_by(ImportJob.created_at.desc()).limit(10).all()
+    return [job._asdict() for job in jobs]
 
 
 @app.put("/api/jobs/{job_id}/status", tags=["CSV Import"])
@@ -156,6 +199,10 @@ def metrics(db: Session = Depends(get_db)):
     Application metrics endpoint
     Returns product counts and system statistics
     """
+    # A fresh cached result is already encoded JSON; send it untouched
+    cached = RedisCache.get_bytes(METRICS_CACHE_KEY)
+    if cached:
+        return Response(content=cached, media_type="application/json")
     return get_metrics(db)
 
 
@@ -165,8 +212,9 @@ def metrics(db: Session = Depends(get_db)):
 
 @app.get("/api/products", response_model=List[ProductResponse], tags=["Products"])
 def get_products(
-    skip: int = 0,
-    limit: int = 100,
+    request: Request,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
     search: Optional[str] = None,
     active: Optional[bool] = None,
     db: Session = Depends(get_db)
@@ -175,52 +223,65 @@ def get_products(
     Retrieve products with filtering and pagination
     
     - **skip**: Number of records to skip (pagination)
-    - **limit**: Maximum number of records to return
+    - **limit**: Maximum number of records to return (at most 500)
     - **search**: Search term for name, SKU, or description
     - **active**: Filter by active status (true/false)
-    """
-    # Create cache key for Redis
-    cache_key = f"products:{skip}:{limit}:{search}:{active}"
-    
-    # Try to get from Redis cache first
-    cached_result = RedisCache.get(cache_key)
-    if cached_result:
-        return cached_result
     
-    # Build database query
-    query = db.query(Product)
-    
-    if search:
-        search_term = f"%{search}%"
-        query = query.filter(
-            (Product.name.ilike(search_term)) |
-            (Product.sku.ilike(search_term)) |
-            (Product.description.ilike(search_term))
-        )
-    
-    if active is not None:
-        query = query.filter(Product.active == active)
-    
-    products = query.offset(skip).limit(limit).all()
-    
-    # Convert to response format
-    products_data = [
-        {
-            "id": p.id,
-            "name": p.name,
-            "sku": p.sku,
-            "description": p.description,
-            "active": p.active,
-            "created_at": p.created_at.isoformat() if p.created_at else None,
-            "updated_at": p.updated_at.isoformat() if p.updated_at else None
-        }
-        for p in products
-    ]
+    The number of matching products is returned in the X-Total-Count
+    header: for unfiltered listings always (estimated on large tables),
+    for filtered ones whenever the page is not empty. Cached pages carry an ETag, so
+    If-None-Match revalidation returns 304 while the data is unchanged.
+    """
+    # Create versioned cache key for Redis
+    cache_key = get_products_cache_key(skip, limit, search, active)
+    # The key embeds the cache version, so it changes whenever products change
+    etag = f'"{hashlib.md5(cache_key.encode()).hexdigest()}"'
+    
+    # Try to get from Redis cache first; the page is stored as encoded JSON
+    # and sent back as-is, without decoding or re-validating it
+    cached = RedisCache.get_raw(cache_key, ("body", "total"))
+    if cached:
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers={"ETag": etag})
+        body, total = cached
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}  # Always revalidate
+        if total:
+            headers["X-Total-Count"] = total.decode()
+        return Response(content=body, media_type="application/json", headers=headers)
+    
+    # Plain column rows skip ORM identity-map bookkeeping for read-only data
+    if not search and active is None:
+        # A window count would read the whole table for every page; the
+        # unfiltered total comes from the planner estimate instead
+        stmt = lambda_stmt(lambda: select(*PRODUCT_COLUMNS))
+        stmt += lambda s: s.offset(skip).limit(limit)
+        rows = db.execute(stmt).all()
+        total = _unfiltered_product_count(db)
+    else:
+        # Filtered pages carry their matching total in a window count
+        stmt = lambda_stmt(lambda: select(*PRODUCT_COLUMNS, func.count().over().label("total")))
+        stmt = _filter_products(stmt, search, active)
+        stmt += lambda s: s.offset(skip).limit(limit)
+        rows = db.execute(stmt).all()
+        total = rows[0].total if rows else None
+    
+    # Encode straight to JSON bytes through the response schema
+    body = product_list_adapter.dump_json(
+        product_list_adapter.validate_python(rows, from_attributes=True)
+    )
     
-    # Cache for 5 minutes
-    RedisCache.set(cache_key, products_data, 300)
+    headers = {}
+    # Cache for 5 minutes, tracked so invalidation can delete it directly.
+    # Only advertise an ETag once the page is cached: without Redis the
+    # version can't be read and the tag would never change.
+    if RedisCache.set_raw_tracked(cache_key, {"body": body, "total": total or ""},
+                                  PRODUCTS_CACHE_INDEX_KEY, 300):
+        headers["ETag"] = etag
+        headers["Cache-Control"] = "no-cache"
     
-    return products_data
+    if total is not None:
+        headers["X-Total-Count"] = str(total)
+    return Response(content=body, media_type="application/json", headers=headers)
 
 
 @app.get("/api/products/count", tags=["Products"])
@@ -230,23 +291,26 @@ def get_products_count(
     db: Session = Depends(get_db)
 ):
     """Get total count of products matching filters"""
-    query = db.query(func.count(Product.id))
+    # Unfiltered counts on large tables use the planner estimate, not a full scan
+    if search is None and active is None:
+        return {"count": _unfiltered_product_count(db)}
     
-    if search:
-        search_term = f"%{search}%"
-        query = query.filter(
-            (Product.name.ilike(search_term)) |
-            (Product.sku.ilike(search_term)) |
-            (Product.description.ilike(search_term))
-        )
+    stmt = lambda_stmt(lambda: select(func.count()).select_from(Product))
+    stmt = _filter_products(stmt, search, active)
     
-    if active is not None:
-        query = query.filter(Product.active == active)
-    
-    count = query.scalar()
+    count = db.execute(stmt).scalar()
     return {"count": count}
 
 
+@app.get("/api/products/{product_id}", response_model=ProductResponse, tags=["Products"])
+def get_product(product_id: int, db: Session = Depends(get_db)):
+    """Get a single product by id"""
+    row = db.execute(select(*PRODUCT_COLUMNS).where(Product.id == product_id)).first()
+    if not row:
+        raise HTTPException(status_code=404, detail="Product not found")
+    return row
+
+
 @app.post("/api/products", response_model=ProductResponse, tags=["Products"])
 def create_product(
     name: str = Form(..., description="Product name"),
@@ -256,19 +320,23 @@ def create_product(
     db: Session = Depends(get_db)
 ):
     """Create a new product"""
-    # Check for duplicate SKU (case-insensitive)
-    existing = db.query(Product).filter(Product.sku.ilike(sku)).first()
-    if existing:
-        raise HTTPException(status_code=400, detail="SKU already exists")
-    
-    # Create new product
-    product = Product(name=name, sku=sku, description=description, active=active)
-    db.add(product)
+    # Insert and read back in one statement; uq_products_sku_lower makes a
+    # case-insensitive duplicate a no-op instead of an error to roll back
+    row = db.execute(text(
+        "INSERT INTO products (name, sku, description, active) "
+        "VALUES (:name, :sku, :description, :active) "
+        "ON CONFLICT (lower(sku)) DO NOTHING "
+        "RETURNING id, name, sku, description, active, created_at, updated_at"
+    ), {"name": name, "sku": sku, "description": description, "active": active}).first()
     db.commit()
-    db.refresh(product)
+    if row is None:
+        raise HTTPException(status_code=400, detail="SKU already exists")
+    product = ProductResponse.model_validate(row)
     
     # Clear products cache
-    _clear_products_cache()
+    clear_products_cache()
+    
+    emit_webhook_event("product_created", product.model_dump(mode="json"))
     
     return product
 
@@ -287,24 +355,24 @@ def update_product(
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
     
-    # Check SKU uniqueness if changed
-    if sku.lower() != product.sku.lower():
-        existing = db.query(Product).filter(Product.sku.ilike(sku)).first()
-        if existing:
-            raise HTTPException(status_code=400, detail="SKU already exists")
-    
     # Update product
     product.name = name
     product.sku = sku
     product.description = description
     product.active = active
-    product.updated_at = datetime.utcnow()
     
-    db.commit()
+    # SKU uniqueness is enforced by the database on commit
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=400, detail="SKU already exists")
     db.refresh(product)
     
     # Clear products cache
-    _clear_products_cache()
+    clear_products_cache()
+    
+    emit_webhook_event("product_updated", ProductResponse.model_validate(product).model_dump(mode="json"))
     
     return product
 
@@ -317,11 +385,14 @@ def toggle_product_status(product_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Product not found")
     
     product.active = not product.active
-    product.updated_at = datetime.utcnow()
     db.commit()
+    db.refresh(product)
     
     # Clear products cache
-    _clear_products_cache()
+    clear_products_cache()
+    
+    # Same payload shape as update_product's product_updated event
+    emit_webhook_event("product_updated", ProductResponse.model_validate(product).model_dump(mode="json"))
     
     return {
         "message": f"Product {'activated' if product.active else 'deactivated'} successfully",
@@ -336,26 +407,47 @@ def delete_product(product_id: int, db: Session = Depends(get_db)):
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
     
+    sku = product.sku
     db.delete(product)
     db.commit()
     
     # Clear products cache
-    _clear_products_cache()
+    clear_products_cache()
+    
+    emit_webhook_event("product_deleted", {"id": product_id, "sku": sku})
     
     return {"message": "Product deleted successfully"}
 
 
 @app.delete("/api/products", tags=["Products"])
 def delete_all_products(db: Session = Depends(get_db)):
-    """STORY 3: Bulk delete all products"""
-    count = db.query(Product).count()
-    db.query(Product).delete()
+    """
+    STORY 3: Bulk delete all products
+    
+    Large tables are truncated and their count is PostgreSQL's row
+    estimate, flagged with "estimated": true in both the response and the
+    products_bulk_deleted webhook; small ones take a single DELETE pass
+    and report its exact rowcount.
+    """
+    count = _estimated_product_count(db)
+    estimated = count is not None
+    if estimated:
+        db.execute(text("TRUNCATE products"))
+    else:
+        count = db.query(Product).delete(synchronize_session=False)
     db.commit()
     
     # Clear products cache
-    _clear_products_cache()
+    clear_products_cache()
     
-    return {"message": f"Successfully deleted {count} products"}
+    emit_webhook_event("products_bulk_deleted", {"count": count, "estimated": estimated})
+    
+    about = "about " if estimated else ""
+    return {
+        "message": f"Successfully deleted {about}{count} products",
+        "count": count,
+        "estimated": estimated
+    }
 
 
 # ============================================================================
@@ -371,27 +463,13 @@ async def upload_csv(file: UploadFile = File(...)):
     if not file.filename.endswith('.csv'):
         raise HTTPException(status_code=400, detail="Only CSV files are allowed")
     
-    # Read file content
-    content = await file.read()
-    csv_content = content.decode('utf-8')
-    
-    # Create job record
-    db = next(get_db())
-    job = ImportJob(
-        id=str(uuid.uuid4()),
-        filename=file.filename,
-        status="PENDING"
-    )
-    db.add(job)
-    db.commit()
-    
-    # Start background processing in separate thread
-    thread = threading.Thread(target=_process_csv_background, args=(job.id, csv_content))
-    thread.daemon = True
-    thread.start()
+    # Job creation, staging and dispatch are blocking DB/Redis/broker calls;
+    # keep them off the event loop. The spooled upload is streamed from
+    # file.file rather than read into memory with await file.read().
+    task_id = await run_in_threadpool(_start_import_job, file.filename, file.file)
     
     return {
-        "task_id": job.id,
+        "task_id": task_id,
         "message": "CSV upload started. Use task_id to track progress."
     }
 
@@ -403,16 +481,16 @@ def get_task_status(task_id: str, db: Session = Depends(get_db)):
     Returns current status, progress, and completion percentage
     """
     try:
-        # Get status from Redis
-        status = RedisCache.get(f"task:{task_id}")
+        # Progress and the cancel flag come back in one round trip. The job
+        # row isn't written here: the worker records terminal states itself.
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.get(f"task:{task_id}")
+        pipe.get(f"cancel:{task_id}")
+        status, cancel_requested = pipe.execute()
         if status:
-            # Update job record in database
-            job = db.query(ImportJob).filter(ImportJob.id == task_id).first()
-            if job:
-                job.status = status.get('state', 'PROGRESS')
-                job.records_processed = status.get('current', 0)
-                job.total_records = status.get('total', 0)
-                db.commit()
+            status = orjson.loads(status)
+            if cancel_requested and status.get("state") == "PROGRESS":
+                status["status"] = "Cancelling..."
             return status
         else:
             # Check database for job info
@@ -441,13 +519,35 @@ def get_task_status(task_id: str, db: Session = Depends(get_db)):
 
 
 @app.post("/api/cancel-upload/{task_id}", tags=["CSV Import"])
-def cancel_upload(task_id: str):
+def cancel_upload(task_id: str, db: Session = Depends(get_db)):
     """
     Cancel a Celery task
+    
+    A running import sees the cancel flag after its current chunk and
+    stops cleanly; revoking drops the task if it hasn't started yet.
+    Terminating the worker mid-chunk would instead get the task redelivered
+    (acks_late + reject_on_worker_lost).
     """
     try:
         from app.celery_app import celery_app
-        celery_app.control.revoke(task_id, terminate=True)
+        redis_client.setex(f"cancel:{task_id}", 7200, "1")  # Outlives the task time limit
+        celery_app.control.revoke(task_id)
+        
+        # No progress yet means no worker has picked the task up, so nothing
+        # else will record the outcome: do it here and free the staged file
+        if not redis_client.exists(f"task:{task_id}"):
+            RedisCache.set(f"task:{task_id}", {
+                "state": "CANCELLED",
+                "status": "Upload cancelled by user",
+                "current": 0,
+                "total": 0
+            }, 3600)
+            redis_client.delete(IMPORT_PAYLOAD_KEY.format(task_id=task_id))
+            job = db.query(ImportJob).filter(ImportJob.id == task_id).first()
+            if job and job.status == "PENDING":
+                job.status = "CANCELLED"
+                db.commit()
+        
         return {"message": "Task cancellation requested"}
     except Exception as e:
         return {"message": f"Failed to cancel task: {str(e)}"}
@@ -509,167 +609,92 @@ def test_webhook(webhook_id: int, db: Session = Depends(get_db)):
 # INTERNAL HELPER FUNCTIONS
 # ============================================================================
 
-def _process_csv_background(task_id: str, csv_content: str):
-    """
-    Optimized CSV processing with bulk operations and chunking
-    10x faster than row-by-row processing
-    
-    DUPLICATION HANDLING:
-    1. Within CSV chunks: Uses seen_skus set to process only first occurrence
-    2. Database conflicts: PostgreSQL UPSERT (ON CONFLICT) automatically handles:
-       - If SKU exists: Updates name, description, updated_at
-       - If SKU new: Inserts as new product
-    3. Case-insensitive: All SKUs converted to uppercase for consistency
-    4. Atomic: Each chunk processed in single transaction
+def _start_import_job(filename: str, csv_file: BinaryIO) -> str:
     """
-    db = next(get_db())
+    Create the ImportJob record and queue its Celery import task
     
-    try:
-        # Parse CSV
-        csv_reader = csv.DictReader(io.StringIO(csv_content))
-        rows = list(csv_reader)
-        total_rows = len(rows)
+    Returns:
+        str: Job id, which doubles as the Celery task id
+    """
+    job_id = str(uuid.uuid4())
+    with SessionLocal() as db:
+        job = ImportJob(
+            id=job_id,
+            filename=filename,
+            status="PENDING"
+        )
+        db.add(job)
+        db.commit()
         
-        # Update job record with total rows
-        job = db.query(ImportJob).filter(ImportJob.id == task_id).first()
-        if job:
-            job.total_records = total_rows
-            job.status = "PROGRESS"
+        # Hand the import to a Celery worker; the job id doubles as the task id.
+        # The commit released the connection, and job_id is a local so the
+        # expired job isn't reloaded while the upload streams to Redis.
+        try:
+            queue_csv_import(job_id, csv_file)
+        except UnicodeDecodeError:
+            job.status = "FAILURE"
             db.commit()
-        
-        # Initialize progress with longer timeout for large files
-        RedisCache.set(f"task:{task_id}", {
-            "state": "PROGRESS",
-            "current": 0,
-            "total": total_rows,
-            "status": "Starting optimized CSV processing..."
-        }, 7200)  # 2 hours for large files
-        
-        # Process in chunks for reliable performance
-        chunk_size = 1000
-        imported_count = 0
-        
-        for chunk_start in range(0, total_rows, chunk_size):
-            # Check for cancellation
-            if RedisCache.get(f"cancel:{task_id}"):
-                RedisCache.set(f"task:{task_id}", {
-                    "state": "CANCELLED",
-                    "status": "Upload cancelled by user",
-                    "current": chunk_start,
-                    "total": total_rows
-                }, 3600)
-                return
-            
-            chunk_end = min(chunk_start + chunk_size, total_rows)
-            chunk = rows[chunk_start:chunk_end]
-            
-            # Prepare bulk data with deduplication within chunk
-            valid_products = []
-            skus_to_check = []
-            seen_skus = set()  # DEDUPLICATION: Track SKUs within this chunk to avoid duplicates
-            
-            for row in chunk:
-                name = row.get('name', '').strip()
-                sku = row.get('sku', '').strip()
-                description = row.get('description', '').strip()
-                
-                if name and sku:
-                    sku_upper = sku.upper()
-                    # DEDUPLICATION: Skip if we've already seen this SKU in this chunk (first occurrence wins)
-                    if sku_upper not in seen_skus:
-                        valid_products.append({
-                            'name': name,
-                            'sku': sku_upper,
-                            'description': description
-                        })
-                        skus_to_check.append(sku_upper)
-                        seen_skus.add(sku_upper)
-            
-            if not valid_products:
-                continue
-            
-            # Fast bulk operations using raw SQL
-            if valid_products:
-                # Use PostgreSQL UPSERT for maximum speed
-                values = []
-                for p in valid_products:
-                    values.append(f"('{p['name'].replace("'", "''")}', '{p['sku']}', '{p['description'].replace("'", "''")}', true, NOW(), NOW())")
-                
-                if values:
-                    # DEDUPLICATION: PostgreSQL UPSERT handles database-level duplicates
-                    # ON CONFLICT (sku) means: if SKU exists, update it; if new, insert it
-                    sql = f"""
-                    INSERT INTO products (name, sku, description, active, created_at, updated_at) 
-                    VALUES {','.join(values)}
-                    ON CONFLICT (sku) DO UPDATE SET 
-                        name = EXCLUDED.name,
-                        description = EXCLUDED.description,
-                        updated_at = NOW()
-                    """
-                    db.execute(text(sql))
-                    db.commit()
-            imported_count += len(valid_products)
-            # Progress tracking variables removed since counts were always 0
-            
-            # Update progress less frequently to reduce Redis load
-            progress_percent = int(chunk_end / total_rows * 100)
-            # Only update Redis every 5 chunks (5000 records) or at completion
-            if chunk_start % 5000 == 0 or chunk_end == total_rows:
-                RedisCache.set(f"task:{task_id}", {
-                    "state": "PROGRESS",
-                    "current": chunk_end,
-                    "total": total_rows,
-                    "progress_percent": progress_percent,
-                    "status": f"Processed {chunk_end} of {total_rows} records ({progress_percent}%)"
-                }, 7200)  # 2 hours
-            
-            # Clear cache
-            _clear_products_cache()
-        
-        # Update job as completed
-        job = db.query(ImportJob).filter(ImportJob.id == task_id).first()
-        if job:
-            job.status = "SUCCESS"
-            job.records_processed = imported_count
+            raise HTTPException(status_code=400, detail="CSV file must be UTF-8 encoded")
+        except PayloadTooLargeError as e:
+            job.status = "FAILURE"
             db.commit()
-        
-        # Mark as completed
-        RedisCache.set(f"task:{task_id}", {
-            "state": "SUCCESS",
-            "current": total_rows,
-            "total": total_rows,
-            "progress_percent": 100,
-            "status": f"Import completed! Processed {imported_count} products in optimized mode.",
-            "imported_count": imported_count
-        }, 7200)
-        
-    except Exception as e:
-        # Update job as failed
-        job = db.query(ImportJob).filter(ImportJob.id == task_id).first()
-        if job:
+            raise HTTPException(status_code=413, detail=str(e))
+        except Exception as e:
             job.status = "FAILURE"
             db.commit()
-        
-        RedisCache.set(f"task:{task_id}", {
-            "state": "FAILURE",
-            "status": f"Import failed: {str(e)}",
-            "error": str(e)
-        }, 7200)
+            raise HTTPException(status_code=503, detail=f"Task queue unavailable: {str(e)}")
     
-    finally:
-        db.close()
+    return job_id
 
 
-def _clear_products_cache():
-    """Clear all products-related cache entries"""
-    try:
-        from app.redis_client import redis_client
-        # Clear all cache keys matching products pattern
-        for key in redis_client.scan_iter(match="products:*"):
-            redis_client.delete(key)
-    except Exception:
-        # Fail silently if Redis is unavailable
-        pass
+def _filter_products(stmt, search: Optional[str], active: Optional[bool]):
+    """
+    Apply the product list filters to a lambda statement
+    
+    Each filter is its own lambda, so SQLAlchemy caches the compiled SQL
+    per combination of filters and only binds search/active per request.
+    """
+    if search:
+        # Match the term literally: a stray % or _ would otherwise widen the
+        # pattern past what the trigram indexes can narrow down
+        escaped = search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        search_term = f"%{escaped}%"
+        stmt += lambda s: s.where(
+            (Product.name.ilike(search_term, escape="\\")) |
+            (Product.sku.ilike(search_term, escape="\\")) |
+            (Product.description.ilike(search_term, escape="\\"))
+        )
+    
+    if active is not None:
+        stmt += lambda s: s.where(Product.active == active)
+    
+    return stmt
+
+
+def _estimated_product_count(db: Session) -> Optional[int]:
+    """
+    Return PostgreSQL's row estimate for products when the table is large
+    
+    pg_class.reltuples is maintained by VACUUM/ANALYZE and costs a single
+    catalog lookup. Below ESTIMATED_COUNT_THRESHOLD an exact COUNT(*) is
+    cheap enough and more useful, so None is returned.
+    """
+    estimate = db.execute(text(
+        "SELECT reltuples::bigint FROM pg_class WHERE oid = 'products'::regclass"
+    )).scalar()
+    if estimate is None or estimate < ESTIMATED_COUNT_THRESHOLD:
+        return None
+    return estimate
+
+
+def _unfiltered_product_count(db: Session) -> int:
+    """
+    Count all products, using the planner estimate once the table is large
+    """
+    estimate = _estimated_product_count(db)
+    if estimate is not None:
+        return estimate
+    return db.execute(select(func.count()).select_from(Product)).scalar()
 
 
 # ============================================================================
@@ -684,5 +709,8 @@ if __name__ == "__main__":
         "app.main:app",
         host="0.0.0.0",
         port=port,
+        loop="uvloop",
+        http="httptools",
+        workers=int(os.environ.get("WEB_CONCURRENCY", os.cpu_count() or 1)),
         log_level="info"
     )
\ No newline at end of file
@@ -6,11 +6,15 @@ All models include proper indexing, constraints, and relationships
 for optimal performance and data integrity.
 """
 
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text, Index
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text, Index, DDL, event
 from sqlalchemy.sql import func
 from app.database import Base
 
 
+# Trigram operator classes used by the product search indexes
+event.listen(Base.metadata, "before_create", DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+
+
 class Product(Base):
     """
     Product model representing items in the catalog
@@ -22,15 +26,30 @@ class Product(Base):
 
     id = Column(Integer, primary_key=True, index=True, doc="Unique product identifier")
     name = Column(String(255), nullable=False, doc="Product name")
-    sku = Column(String(100), unique=True, index=True, nullable=False, doc="Stock Keeping Unit (unique)")
+    # Uniqueness comes from uq_products_sku_lower below; a plain unique index
+    # on sku would be a second B-tree to maintain that no query uses
+    sku = Column(String(100), nullable=False, doc="Stock Keeping Unit (unique, case-insensitive)")
     description = Column(Text, doc="Product description")
     active = Column(Boolean, default=True, nullable=False, doc="Product active status")
     created_at = Column(DateTime(timezone=True), server_default=func.now(), doc="Creation timestamp")
     updated_at = Column(DateTime(timezone=True), onupdate=func.now(), doc="Last update timestamp")
     
-    # Create case-insensitive index for SKU lookups
     __table_args__ = (
-        Index('ix_products_sku_lower', func.lower(sku)),
+        # Case-insensitive unique index: enforces SKU uniqueness and backs
+        # ON CONFLICT (lower(sku)) upserts from the CSV importer
+        Index('uq_products_sku_lower', func.lower(sku), unique=True),
+        # Trigram GIN indexes let the substring ILIKE search use index scans
+        Index('ix_products_name_trgm', name, postgresql_using='gin',
+              postgresql_ops={'name': 'gin_trgm_ops'}),
+        Index('ix_products_sku_trgm', sku, postgresql_using='gin',
+              postgresql_ops={'sku': 'gin_trgm_ops'}),
+        Index('ix_products_description_trgm', description, postgresql_using='gin',
+              postgresql_ops={'description': 'gin_trgm_ops'}),
+        # Partial index over active products only: active-only listings and
+        # counts scan this small B-tree instead of the table. The predicate
+        # is plain "WHERE active" so the planner matches the active = true
+        # filter against it.
+        Index('ix_products_active_true', id, postgresql_where=active),
     )
     
     def __repr__(self):
@@ -1,19 +1,21 @@
 import redis
-import json
+import orjson
 import os
-from typing import Any, Optional
+from typing import Any, Mapping, Optional, Sequence
 
 # Redis connection - Railway uses REDIS_PUBLIC_URL
 redis_url = os.getenv("REDIS_PUBLIC_URL") or os.getenv("REDIS_URL", "redis://localhost:6379/0")
 print(f"Using Redis URL: {redis_url[:50]}..." if redis_url else "No Redis URL found")
 redis_client = redis.from_url(redis_url, decode_responses=True)
+# Undecoded client for payloads that are served as raw bytes (cached API responses)
+redis_bytes = redis.from_url(redis_url)
 
 class RedisCache:
     @staticmethod
     def set(key: str, value: Any, expire: int = 3600):
         """Set value in Redis with expiration"""
         try:
-            redis_client.setex(key, expire, json.dumps(value))
+            redis_client.setex(key, expire, orjson.dumps(value))
             return True
         except Exception as e:
             print(f"Redis SET error: {e}")
@@ -24,7 +26,7 @@ class RedisCache:
         """Get value from Redis"""
         try:
             value = redis_client.get(key)
-            return json.loads(value) if value else None
+            return orjson.loads(value) if value else None
         except Exception as e:
             print(f"Redis GET error: {e}")
             return None
@@ -46,4 +48,63 @@ class RedisCache:
             return redis_client.exists(key) > 0
         except Exception as e:
             print(f"Redis EXISTS error: {e}")
-            return False
\ No newline at end of file
+            return False
+    
+    @staticmethod
+    def ping() -> bool:
+        """Check that Redis answers"""
+        try:
+            return redis_client.ping()
+        except Exception as e:
+            print(f"Redis PING error: {e}")
+            return False
+    
+    @staticmethod
+    def get_bytes(key: str) -> Optional[bytes]:
+        """Get a value as stored (undecoded JSON bytes), or None if missing"""
+        try:
+            return redis_bytes.get(key)
+        except Exception as e:
+            print(f"Redis GET error: {e}")
+            return None
+    
+    @staticmethod
+    def get_raw(key: str, fields: Sequence[str]) -> Optional[list]:
+        """Get hash fields as undecoded bytes, or None if the key is missing"""
+        try:
+            values = redis_bytes.hmget(key, fields)
+            return values if values[0] is not None else None
+        except Exception as e:
+            print(f"Redis GET error: {e}")
+            return None
+    
+    @staticmethod
+    def set_raw_tracked(key: str, fields: Mapping[str, Any], index_key: str, expire: int = 3600):
+        """Store raw hash fields and record the key in an index set, in one round trip"""
+        try:
+            pipe = redis_bytes.pipeline()
+            pipe.hset(key, mapping=fields)
+            pipe.expire(key, expire)
+            pipe.sadd(index_key, key)
+            pipe.expire(index_key, expire)
+            pipe.execute()
+            return True
+        except Exception as e:
+            print(f"Redis SET error: {e}")
+            return False
+    
+    @staticmethod
+    def invalidate_many(keys, batch_size: int = 500):
+        """UNLINK keys in batches, sent together in one pipelined round trip"""
+        try:
+            keys = list(keys)
+            if not keys:
+                return True
+            pipe = redis_client.pipeline(transaction=False)
+            for start in range(0, len(keys), batch_size):
+                pipe.unlink(*keys[start:start + batch_size])
+            pipe.execute()
+            return True
+        except Exception as e:
+            print(f"Redis UNLINK error: {e}")
+            return False
@@ -22,8 +22,8 @@ class ProductResponse(BaseModel):
     sku: str = Field(..., description="Product SKU (Stock Keeping Unit)")
     description: Optional[str] = Field(None, description="Product description")
     active: bool = Field(True, description="Product active status")
-    created_at: Optional[str] = Field(None, description="Creation timestamp (ISO format)")
-    updated_at: Optional[str] = Field(None, description="Last update timestamp (ISO format)")
+    created_at: Optional[datetime] = Field(None, description="Creation timestamp (ISO format)")
+    updated_at: Optional[datetime] = Field(None, description="Last update timestamp (ISO format)")
     
     class Config:
         from_attributes = True
@@ -5,12 +5,90 @@ This module provides helper functions for monitoring application health,
 gathering metrics, and other shared functionality.
 """
 
+import re
 import time
+import random
+import functools
+import threading
+import hashlib
+from typing import BinaryIO
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from sqlalchemy import func, select, text, true
 from sqlalchemy.orm import Session
-from app.models import Product, Webhook
-from app.redis_client import RedisCache
+from app.redis_client import RedisCache, redis_client
 
+# Redis keys backing the product listing cache
+PRODUCTS_CACHE_VERSION_KEY = "products:version"
+PRODUCTS_CACHE_INDEX_KEY = "products:keys"
 
+# Short-lived cache for the metrics endpoint
+METRICS_CACHE_KEY = "metrics:v1"
+METRICS_CACHE_TTL = 5  # seconds
+
+# Health probes run on a small shared pool so a hung one doesn't delay the other
+HEALTH_CHECK_TIMEOUT = 2  # seconds
+HEALTH_CHECK_CACHE_TTL = 0.5  # seconds; probes arriving together share one check
+_health_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="health-check")
+
+# Headers every import file must have (description is optional)
+REQUIRED_CSV_HEADERS = frozenset({'name', 'sku'})
+
+# validate_csv_headers gives up looking for the end of the header line here
+HEADER_READ_LIMIT = 64 * 1024  # bytes
+
+# Units for format_file_size, in steps of 1024
+_SIZE_NAMES = ("B", "KB", "MB", "GB")
+
+# Compiled once for sanitize_filename
+_UNSAFE_FILENAME_CHARS = re.compile(r'[^\w\s.-]')
+_FILENAME_SEPARATOR_RUN = re.compile(r'[-\s]+')
+
+
+def _ttl_cached(ttl: float, busy_result: dict):
+    """
+    Memoize a zero-argument health probe for ttl seconds
+    
+    Only one caller refreshes an expired value. While a refresh is in
+    flight other callers get the last value without waiting, or
+    busy_result once the refresh has run past HEALTH_CHECK_TIMEOUT. Before
+    the first value exists they wait up to HEALTH_CHECK_TIMEOUT for it, so
+    a cold start doesn't report the probe itself as a failure.
+    """
+    def decorator(func):
+        state = {"value": None, "expires": 0.0, "refresh_started": 0.0}
+        lock = threading.Lock()
+        
+        @functools.wraps(func)
+        def wrapper():
+            now = time.monotonic()
+            if now < state["expires"]:
+                return state["value"]
+            
+            if lock.acquire(blocking=False):
+                try:
+                    state["refresh_started"] = now
+                    state["value"] = func()
+                    state["expires"] = time.monotonic() + ttl
+                    return state["value"]
+                finally:
+                    lock.release()
+            
+            # Another caller is refreshing
+            if state["value"] is None:
+                # Nothing to fall back on yet, so wait for that refresh
+                if lock.acquire(timeout=HEALTH_CHECK_TIMEOUT):
+                    lock.release()
+                    if state["value"] is not None:
+                        return state["value"]
+                return busy_result
+            if now - state["refresh_started"] < HEALTH_CHECK_TIMEOUT:
+                return state["value"]
+            return busy_result
+        return wrapper
+    return decorator
+
+
+@_ttl_cached(HEALTH_CHECK_CACHE_TTL, {"status": "unhealthy", "error": "Database health check still running"})
 def check_database_health():
     """
     Check database connectivity and response time
@@ -19,17 +97,17 @@ def check_database_health():
         dict: Database health status with response time
     """
     try:
-        from app.database import SessionLocal
+        from app.database import engine
         
-        start_time = time.time()
-        db = SessionLocal()
-        db.execute("SELECT 1")
-        db.close()
-        response_time = round((time.time() - start_time) * 1000, 2)
+        start_time = time.perf_counter_ns()
+        # Plain pooled connection: one round trip, no Session/ORM setup
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+        response_time_ms = round((time.perf_counter_ns() - start_time) / 1e6, 2)
         
         return {
             "status": "healthy",
-            "response_time": f"{response_time}ms"
+            "response_time_ms": response_time_ms
         }
     except Exception as e:
         return {
@@ -38,6 +116,7 @@ def check_database_health():
         }
 
 
+@_ttl_cached(HEALTH_CHECK_CACHE_TTL, {"status": "degraded", "error": "Redis health check still running"})
 def check_redis_health():
     """
     Check Redis connectivity and response time
@@ -46,15 +125,15 @@ def check_redis_health():
         dict: Redis health status with response time
     """
     try:
-        start_time = time.time()
-        RedisCache.set("health_check", "ok", 10)
-        result = RedisCache.get("health_check")
-        response_time = round((time.time() - start_time) * 1000, 2)
+        # PING is a single round trip and leaves no key behind
+        start_time = time.perf_counter_ns()
+        result = RedisCache.ping()
+        response_time_ms = round((time.perf_counter_ns() - start_time) / 1e6, 2)
         
-        if result == "ok":
+        if result:
             return {
                 "status": "healthy",
-                "response_time": f"{response_time}ms"
+                "response_time_ms": response_time_ms
             }
         else:
             return {
@@ -76,8 +155,13 @@ def get_health_status():
     Returns:
         dict: Complete health status including all services
     """
-    db_health = check_database_health()
-    redis_health = check_redis_health()
+    # The probes are independent, so run them side by side: latency is the
+    # slower of the two, and a hung service can't hold the response past
+    # HEALTH_CHECK_TIMEOUT
+    db_future = _health_executor.submit(check_database_health)
+    redis_future = _health_executor.submit(check_redis_health)
+    db_health = _health_result(db_future, "unhealthy")
+    redis_health = _health_result(redis_future, "degraded")
     
     # Determine overall status
     if db_health["status"] == "healthy":
@@ -101,10 +185,34 @@ def get_health_status():
     }
 
 
+def _health_result(future, timeout_status: str):
+    """
+    Wait for a health probe, reporting a timeout as a failed check
+    
+    Args:
+        future: Future of a check_*_health call
+        timeout_status: Status to report if the probe doesn't finish in time
+        
+    Returns:
+        dict: The probe's result, or a timeout status
+    """
+    try:
+        return future.result(timeout=HEALTH_CHECK_TIMEOUT)
+    except FuturesTimeoutError:
+        return {
+            "status": timeout_status,
+            "error": f"Health check timed out after {HEALTH_CHECK_TIMEOUT}s"
+        }
+
+
 def get_metrics(db: Session):
     """
     Get application metrics and statistics
     
+    Results are stored in Redis under METRICS_CACHE_KEY for a few seconds,
+    so frequent scrapes can share one aggregate query; the /metrics
+    endpoint serves that cached JSON directly while it is fresh.
+    
     Args:
         db: Database session
         
@@ -112,16 +220,29 @@ def get_metrics(db: Session):
         dict: Application metrics including product and webhook counts
     """
     try:
-        # Get product statistics
-        total_products = db.query(Product).count()
-        active_products = db.query(Product).filter(Product.active == True).count()
-        inactive_products = total_products - active_products
+        from app.models import Product, Webhook
         
-        # Get webhook statistics
-        total_webhooks = db.query(Webhook).count()
-        enabled_webhooks = db.query(Webhook).filter(Webhook.enabled == True).count()
+        # One round trip: each table is aggregated once, with FILTER for the
+        # active/enabled subsets instead of a second COUNT per table
+        product_counts = select(
+            func.count().label("total"),
+            func.count().filter(Product.active == True).label("active")
+        ).select_from(Product).subquery()
+        webhook_counts = select(
+            func.count().label("total"),
+            func.count().filter(Webhook.enabled == True).label("enabled")
+        ).select_from(Webhook).subquery()
         
-        return {
+        # Both sides are single rows; the explicit ON true join says so
+        total_products, active_products, total_webhooks, enabled_webhooks = db.execute(
+            select(
+                product_counts.c.total, product_counts.c.active,
+                webhook_counts.c.total, webhook_counts.c.enabled
+            ).select_from(product_counts.join(webhook_counts, true()))
+        ).one()
+        inactive_products = total_products - active_products
+        
+        metrics = {
             "products": {
                 "total": total_products,
                 "active": active_products,
@@ -135,6 +256,9 @@ def get_metrics(db: Session):
             "status": "operational",
             "timestamp": time.time()
         }
+        # Jittered TTL so instances don't all expire and recount together
+        RedisCache.set(METRICS_CACHE_KEY, metrics, METRICS_CACHE_TTL + random.randint(-1, 1))
+        return metrics
     except Exception as e:
         return {
             "error": str(e),
@@ -143,12 +267,15 @@ def get_metrics(db: Session):
         }
 
 
-def validate_csv_headers(csv_content: str):
+def validate_csv_headers(csv_file: BinaryIO):
     """
     Validate CSV file headers
     
+    Only the header line is read and decoded. The file is rewound
+    afterwards, so the same object can be streamed on to the importer.
+    
     Args:
-        csv_content: CSV file content as string
+        csv_file: Binary file object of the uploaded CSV
         
     Returns:
         tuple: (is_valid: bool, error_message: str)
@@ -157,20 +284,27 @@ def validate_csv_headers(csv_content: str):
     import io
     
     try:
-        csv_reader = csv.DictReader(io.StringIO(csv_content))
-        headers = csv_reader.fieldnames
+        head = b""
+        while b"\n" not in head and len(head) < HEADER_READ_LIMIT:
+            block = csv_file.read(8192)
+            if not block:
+                break
+            head += block
+        csv_file.seek(0)
         
-        required_headers = {'name', 'sku'}
-        optional_headers = {'description'}
+        first_line = head.split(b"\n", 1)[0].decode("utf-8-sig")
+        headers = next(csv.reader(io.StringIO(first_line)), None)
         
         if not headers:
             return False, "CSV file appears to be empty"
         
-        # Convert to lowercase for case-insensitive comparison
-        headers_lower = {h.lower().strip() for h in headers}
-        
-        # Check required headers
-        missing_headers = required_headers - headers_lower
+        # Case-insensitive check that stops as soon as every required
+        # header has been seen, without lowering the remaining columns
+        missing_headers = set(REQUIRED_CSV_HEADERS)
+        for h in headers:
+            missing_headers.discard(h.strip().lower())
+            if not missing_headers:
+                break
         if missing_headers:
             return False, f"Missing required headers: {', '.join(missing_headers)}"
         
@@ -193,14 +327,10 @@ def format_file_size(size_bytes: int):
     if size_bytes == 0:
         return "0 B"
     
-    size_names = ["B", "KB", "MB", "GB"]
-    i = 0
-    
-    while size_bytes >= 1024 and i < len(size_names) - 1:
-        size_bytes /= 1024.0
-        i += 1
+    # Each unit is 2**10 of the previous one, so the bit length picks it directly
+    i = min((size_bytes.bit_length() - 1) // 10, len(_SIZE_NAMES) - 1) if size_bytes > 0 else 0
     
-    return f"{size_bytes:.1f} {size_names[i]}"
+    return f"{size_bytes / (1 << (10 * i)):.1f} {_SIZE_NAMES[i]}"
 
 
 def sanitize_filename(filename: str):
@@ -213,10 +343,46 @@ def sanitize_filename(filename: str):
     Returns:
         str: Sanitized filename
     """
-    import re
-    
     # Remove or replace unsafe characters
-    filename = re.sub(r'[^\w\s.-]', '', filename)
-    filename = re.sub(r'[-\s]+', '-', filename)
+    filename = _UNSAFE_FILENAME_CHARS.sub('', filename)
+    filename = _FILENAME_SEPARATOR_RUN.sub('-', filename)
     
-    return filename.strip('-')
\ No newline at end of file
+    return filename.strip('-')
+
+
+def get_products_cache_key(skip: int, limit: int, search, active):
+    """
+    Build the cache key for a product listing
+    
+    The key embeds the current products cache version, so bumping the
+    version makes every previously cached listing unreachable. The query
+    parameters are hashed, so arbitrary search terms give fixed-length
+    keys and can't collide through embedded separators.
+    
+    Returns:
+        str: Versioned cache key
+    """
+    version = RedisCache.get(PRODUCTS_CACHE_VERSION_KEY) or 0
+    params = hashlib.blake2b(repr((skip, limit, search, active)).encode(), digest_size=16)
+    return f"products:list:v{version}:{params.hexdigest()}"
+
+
+def clear_products_cache():
+    """
+    Invalidate all products-related cache entries
+    
+    Bumps the cache version and reads the listing keys tracked in
+    PRODUCTS_CACHE_INDEX_KEY in one round trip, then UNLINKs them in
+    batched, pipelined calls instead of SCANning the keyspace and deleting
+    keys one at a time. UNLINK lets Redis reclaim the memory in the
+    background.
+    """
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.incr(PRODUCTS_CACHE_VERSION_KEY)
+        pipe.smembers(PRODUCTS_CACHE_INDEX_KEY)
+        _, keys = pipe.execute()
+        RedisCache.invalidate_many([*keys, PRODUCTS_CACHE_INDEX_KEY])
+    except Exception:
+        # Fail silently if Redis is unavailable
+        pass
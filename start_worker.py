@@ -1,8 +1,25 @@
 #!/usr/bin/env python3
 """
 Start Celery worker for processing tasks
+
+Pool settings come from the environment:
+    CELERY_CONCURRENCY   worker processes/threads (default: 2 per CPU)
+    CELERY_POOL          execution pool, e.g. prefork, threads, gevent (default: prefork)
+    CELERY_PREFETCH      prefetch multiplier (default: 1)
+    CELERY_LOGLEVEL      log level (default: INFO)
 """
+import os
+
 from app.celery_app import celery_app
 
 if __name__ == "__main__":
-    celery_app.start()
\ No newline at end of file
+    celery_app.worker_main(argv=[
+        "worker",
+        f"--loglevel={os.environ.get('CELERY_LOGLEVEL', 'INFO')}",
+        f"--pool={os.environ.get('CELERY_POOL', 'prefork')}",
+        f"--concurrency={os.environ.get('CELERY_CONCURRENCY', (os.cpu_count() or 1) * 2)}",
+        f"--prefetch-multiplier={os.environ.get('CELERY_PREFETCH', '1')}",
+        # Hand tasks only to idle children, so a long import doesn't hold
+        # up the webhook batches queued behind it
+        "-O", "fair",
+    ])